@@ -1,14 +1,67 @@
 """ render.py - Extract spec text and convert to a Word document. """
 
-import os, shutil, subprocess, tempfile, zipfile
-import codecs, markdown, html5lib, re
-import xml.etree.ElementTree as ET
+import copy, io, itertools, os, time, zipfile
+import markdown, html5lib, re
+try:
+    from lxml import etree as ET
+    import lxml.html as lxml_html
+except ImportError:
+    import xml.etree.cElementTree as ET
+    lxml_html = None
+
+# Buffer size for reading the JS source.
+io_buffer_size = 1 << 20
 
 section_boundary_re = re.compile(r'^(?=#)', re.MULTILINE)
+start_tag_re = re.compile(r'<(?![?!])[^>]*>')
+run_break_re = re.compile(ur'([\f\n])')
+whitespace_re = re.compile(ur'\s+', re.UNICODE)
+
+# A "//>" line in the JS source. The group is the line's spec text: what
+# follows the "//>" and at most one space, minus trailing whitespace.
+doc_line_re = re.compile(ur'^[^\S\n]*//>[ ]?(.*?)[^\S\n]*$', re.MULTILINE | re.UNICODE)
+
+heading_split_re = re.compile(ur'(?m)^(#.*)$')
+heading_params_re = re.compile(ur'\([^)]*\)')
+word_re = re.compile(ur'\w+')
+
+# Patterns that introduce names in the body of a section. Each group
+# captures one name.
+name_intro_res = [
+    re.compile(ur'\bcalled\s+on\s+an\s+object\s+(\w+)'),
+    re.compile(ur'(?i)\.\s+let\s+(\w+)\s+be\b'),
+    re.compile(ur'(?i)\.\s+for each\s+(\w+)\s+in\b'),
+    re.compile(ur'(?i)\bfunction\s+(\w+)\s+is\s+called,'),
+    re.compile(ur'(?i)\bfunction\s+(\w+)\s+is\s+called\s+with\s+argument\s+(\w+),'),
+    re.compile(ur'(?i)\bfunction\s+(\w+)\s+is\s+called\s+with\s+arguments\s+(\w+)\s+and\s+(\w+),'),
+]
+
+the_this_value_re = re.compile(ur'\b(the\s+)this(\s+value)\b')
+
+# Compiled name-matching regexps, keyed by the set of names. Sections
+# often introduce the same names, so this saves recompiling the pattern.
+names_re_cache = {}
+names_re_cache_size = 1024
+
+def names_re_for(names):
+    """ Return a regexp matching any of `names` as a whole word, unless it
+    is next to a `*` (already emphasized). """
+    key = frozenset(names)
+    names_re = names_re_cache.get(key)
+    if names_re is None:
+        if len(names_re_cache) >= names_re_cache_size:
+            names_re_cache.clear()
+        # Longest names first, so that no name is shadowed by a prefix of
+        # itself.
+        names_re = names_re_cache[key] = re.compile(
+            ur'(?<!\*)\b(?:'
+            + ur'|'.join(re.escape(n) for n in sorted(key, key=len, reverse=True))
+            + ur')\b(?!\*)')
+    return names_re
 
 def preprocess(source):
     """ Heuristically inject additional formatting into the Markdown source. """
-    sections = re.split(ur'(?m)^(#.*)$', source)
+    sections = heading_split_re.split(source)
     result = u''
     for i in range(1, len(sections), 2):
         heading = sections[i]
@@ -16,36 +69,22 @@ def preprocess(source):
         names = set()
 
         # Find names in the heading.
-        m = re.search(ur'\([^)]*\)', heading)
+        m = heading_params_re.search(heading)
         if m is not None:
-            names |= set(re.findall(ur'\w+', m.group(0)))
+            names |= set(word_re.findall(m.group(0)))
 
         # Find names in the body.
-        for m in re.finditer(ur'\bcalled\s+on\s+an\s+object\s+(\w+)', body):
-            names.add(m.group(1))
-        for m in re.finditer(ur'(?i)\.\s+let\s+(\w+)\s+be\b', body):
-            names.add(m.group(1))
-        for m in re.finditer(ur'(?i)\.\s+for each\s+(\w+)\s+in\b', body):
-            names.add(m.group(1))
-        for m in re.finditer(ur'(?i)\bfunction\s+(\w+)\s+is\s+called,', body):
-            names.add(m.group(1))
-        for m in re.finditer(ur'(?i)\bfunction\s+(\w+)\s+is\s+called\s+with\s+argument\s+(\w+),', body):
-            names.add(m.group(1))
-            names.add(m.group(2))
-        for m in re.finditer(ur'(?i)\bfunction\s+(\w+)\s+is\s+called\s+with\s+arguments\s+(\w+)\s+and\s+(\w+),', body):
-            names.add(m.group(1))
-            names.add(m.group(2))
-            names.add(m.group(3))
+        for name_re in name_intro_res:
+            for m in name_re.finditer(body):
+                names.update(m.groups())
 
         if names:
             # Italicize all names in the body.
-            pattern = ur'(?<!\*)\b(' + ur'|'.join(names) + ur')\b(?!\*)'
-            body = re.sub(pattern, lambda m: u'<var>' + m.group(1) + u'</var>', body)
+            body = names_re_for(names).sub(lambda m: u'<var>' + m.group(0) + u'</var>', body)
 
         # Make "this" bold in "the this value".
-        body = re.sub(ur'\b(the\s+)this(\s+value)\b',
-                      lambda m: m.group(1) + u"**this**" + m.group(2),
-                      body)
+        body = the_this_value_re.sub(lambda m: m.group(1) + u"**this**" + m.group(2),
+                                     body)
 
         # It might be nice to do pretty quotes and apostrophes here. (The
         # standard has pretty quotes in some places and ASCII in others.)
@@ -54,18 +93,38 @@ def preprocess(source):
     return result
 
 w_ns = u"http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+xml_ns = u"http://www.w3.org/XML/1998/namespace"
 ET.register_namespace("w", w_ns)
 
-def html_to_ooxml(html_element, first_numId, first_abstractNumId):
-    html_ns = u"http://www.w3.org/1999/xhtml"
+w_prefix = u"{" + w_ns + u"}"
+w_qnames = {}
+
+def w(name):
+    """ Return the ElementTree name for `name` in the w: namespace. """
+    qname = w_qnames.get(name)
+    if qname is None:
+        qname = w_qnames[name] = w_prefix + name
+    return qname
+
+html_ns = u"http://www.w3.org/1999/xhtml"
+html_prefix = u"{" + html_ns + u"}"
+html_prefix_len = len(html_prefix)
 
+# Formatting flags for runs of text, one per inline HTML element we support.
+EM, STRONG, CODE, VAR = 1, 2, 4, 8
+inline_tag_flags = {'em': EM, 'strong': STRONG, 'code': CODE, 'var': VAR}
+
+def html_to_ooxml(html_element, first_numId, first_abstractNumId):
+    """ Convert the body of an HTML document to OOXML. Returns a pair
+    (paragraphs, num_pairs). `paragraphs` is an iterator of <w:p> elements,
+    generated lazily. `num_pairs` is a list of the (numId, abstractNumId)
+    pairs for the lists in the document; it is complete only once
+    `paragraphs` has been exhausted. """
     def w_element(name, content=(), **attrs):
-        e = ET.Element(u"{" + w_ns + u"}" + name)
+        e = ET.Element(w(name))
         for k, v in attrs.items():
-            e.set(u"{" + w_ns + u"}" + k, v)
-        for child in content:
-            assert child is not None
-            e.append(child)
+            e.set(w(k), v)
+        e.extend(content)
         return e
 
     class Paragraph(list):
@@ -100,10 +159,10 @@ def html_to_ooxml(html_element, first_numId, first_abstractNumId):
 
             return w_element(u"p", content)
 
-    class Run(unicode):
-        __slots__ = ['em', 'strong', 'code', 'var']
-        def __init__(self, str):
-            assert self == str
+    class Run(object):
+        __slots__ = ['text', 'em', 'strong', 'code', 'var']
+        def __init__(self, text):
+            self.text = text
             self.em = False
             self.strong = False
             self.code = False
@@ -112,20 +171,17 @@ def html_to_ooxml(html_element, first_numId, first_abstractNumId):
         def to_etree(self):
             content = []
 
-            rPr = []
-            if self.em or self.var:
-                rPr.append(w_element(u"i"))
-            if self.code or self.strong:
-                rPr.append(w_element(u"b"))
-            if self.code:
-                rPr.append(w_element(u"rFonts", ascii=u"Courier New", hAnsi=u"Courier New"))
-            elif self.var:
-                rPr.append(w_element(u"rFonts", ascii=u"Times New Roman", hAnsi=u"Times New Roman"))
-            if rPr:
-                content.append(w_element(u"rPr", rPr))
-
-            for part in re.split(r"([\f\n])", self):
-                if part == "\n": 
+            rPr = rPr_templates[self.em, self.strong, self.code, self.var]
+            if rPr is not None:
+                content.append(copy.deepcopy(rPr))
+
+            text = self.text
+            if u"\f" in text or u"\n" in text:
+                parts = run_break_re.split(text)
+            else:
+                parts = (text,)  # the usual case: no breaks, at most one <w:t>
+            for part in parts:
+                if part == "\n":
                     content.append(w_element(u"br"))
                 elif part == "\f":
                     content.append(w_element(u"br", type=u"page"))
@@ -134,8 +190,8 @@ def html_to_ooxml(html_element, first_numId, first_abstractNumId):
                 elif part:
                     # need xml:space="preserve"?
                     t = w_element(u"t")
-                    if part.strip() != part:
-                        t.set("xml:space", "preserve")
+                    if part.strip() != part or u"  " in part:
+                        t.set(u"{" + xml_ns + u"}space", u"preserve")
                     t.text = part
                     content.append(t)
                 else:
@@ -143,78 +199,114 @@ def html_to_ooxml(html_element, first_numId, first_abstractNumId):
 
             return w_element(u"r", content)
 
-    def make_run(text, attrs):
+    def rPr_element(em, strong, code, var):
+        rPr = []
+        if em or var:
+            rPr.append(w_element(u"i"))
+        if code or strong:
+            rPr.append(w_element(u"b"))
+        if code:
+            rPr.append(w_element(u"rFonts", ascii=u"Courier New", hAnsi=u"Courier New"))
+        elif var:
+            rPr.append(w_element(u"rFonts", ascii=u"Times New Roman", hAnsi=u"Times New Roman"))
+        if rPr:
+            return w_element(u"rPr", rPr)
+        return None
+
+    # The <w:rPr> for each combination of Run flags, built once. Runs get a
+    # deep copy of the one they need.
+    rPr_templates = {flags: rPr_element(*flags)
+                     for flags in itertools.product((False, True), repeat=4)}
+
+    def make_run(text, flags):
         # Normalize all whitespace to single spaces.
-        text = "[" + text + "]"
-        text = " ".join(text.split())
-        text = text[1:-1]
+        text = whitespace_re.sub(u" ", text)
 
         # But if this is a NOTE, include a tab.
         if text.startswith("NOTE "):
             text = "NOTE\t" + text[5:]
 
         r = Run(text)
-        for k in attrs:
-            if attrs[k]:
-                setattr(r, k, True)
+        if flags:
+            r.em = bool(flags & EM)
+            r.strong = bool(flags & STRONG)
+            r.code = bool(flags & CODE)
+            r.var = bool(flags & VAR)
         return r
 
     def element_tag(e):
         tag = e.tag
-        if tag.startswith("{" + html_ns + "}"):
-            return tag[len("{" + html_ns + "}"):]
+        if tag.startswith(html_prefix):
+            return tag[html_prefix_len:]
         else:
             return tag
 
     def is_inline(e):
-        return element_tag(e) in ('em', 'strong', 'code', 'var')
+        return element_tag(e) in inline_tag_flags
 
-    def content_of_li_element_to_runs_and_blocks(e, attrs):
+    def content_of_li_element_to_runs_and_blocks(e, flags):
         runs = []
         blocks = []
         if e.text:
-            runs.append(make_run(e.text, attrs))
+            runs.append(make_run(e.text, flags))
         for child in e:
             if is_inline(child):
                 assert len(blocks) == 0
-                runs += list(convert_inline(child))
+                runs.extend(convert_inline(child))
                 if child.tail:
-                    runs.append(make_run(child.tail, attrs))
+                    runs.append(make_run(child.tail, flags))
             else:
                 blocks.append(child)
         return runs, blocks
 
-    def content_of_element_to_runs(e, attrs):
+    def content_of_element_to_runs(e, flags):
         if e.text:
-            yield make_run(e.text, attrs)
+            yield make_run(e.text, flags)
         for child in e:
             for run in convert_inline(child):
                 yield run
             if child.tail:
-                yield make_run(child.tail, attrs)
+                yield make_run(child.tail, flags)
 
-    def convert_inline(e, **attrs):
+    def convert_inline(e, flags=0):
         tag = element_tag(e)
         if is_inline(e):
-            attrs[tag] = True
-            for run in content_of_element_to_runs(e, attrs):
+            flags |= inline_tag_flags[tag]
+            for run in content_of_element_to_runs(e, flags):
                 yield run
         else:
             raise Exception("unrecognized tag: <" + tag + ">")
 
-    def content_to_para(e, preserve_space=False, pStyle=None):
-        content = list(content_of_element_to_runs(e, {}))
-        if pStyle is None and content and content[0].startswith("NOTE\t"):
-            pStyle = "Note"
-        p = Paragraph(content, pStyle)
+    def coalesce_runs(runs):
+        """ Merge each run into the one before it, if they have the same
+        formatting, so that the paragraph has fewer <w:r> elements. """
+        prev = None
+        for run in runs:
+            if (prev is not None
+                  and prev.em == run.em and prev.strong == run.strong
+                  and prev.code == run.code and prev.var == run.var
+                  and u"\f" not in prev.text and u"\f" not in run.text):
+                prev.text += run.text
+            else:
+                if prev is not None:
+                    yield prev
+                prev = run
+        if prev is not None:
+            yield prev
+
+    def content_to_para(e, pStyle=None):
+        p = Paragraph(pStyle=pStyle)
+        p.extend(coalesce_runs(content_of_element_to_runs(e, 0)))
+        if pStyle is None and p and p[0].text.startswith("NOTE\t"):
+            p.pStyle = "Note"
         return p
 
     def convert_li(e, numId, pStyle, list_level):
         assert element_tag(e) == "li"
         assert e.tail is None or e.tail.isspace()
 
-        runs, blocks = content_of_li_element_to_runs_and_blocks(e, {})
-        yield Paragraph(runs, pStyle=pStyle, numId=numId, ilvl=list_level - 1)
+        runs, blocks = content_of_li_element_to_runs_and_blocks(e, 0)
+        yield Paragraph(coalesce_runs(runs), pStyle=pStyle, numId=numId, ilvl=list_level - 1)
         for child in blocks:
             for p in convert_block(child, numId=numId, list_level=list_level):
                 yield p
@@ -262,22 +354,67 @@ def html_to_ooxml(html_element, first_numId, first_abstractNumId):
                 for p in convert_block(child, numId, list_level + 1):
                     yield p
         elif tag == "pre":
-            if len(e) == 1 and e[0].tag == "{" + html_ns + "}code":
+            if len(e) == 1 and element_tag(e[0]) == "code":
                 e = e[0]
             # TODO: produce multiple paragraphs rather than one containing hard breaks
-            yield content_to_para(e, pStyle="CodeSample3", preserve_space=True)
+            yield content_to_para(e, pStyle="CodeSample3")
         elif tag == "hr":
             yield Paragraph([Run("\f")])
         else:
             raise Exception("unrecognized tag: <" + tag + ">")
 
-    paragraphs = []
-    for child in html_element.find("{" + html_ns + "}body"):
-        for wp in convert_block(child):
-            paragraphs.append(wp.to_etree())
-
-    body = w_element("body", paragraphs)
-    return w_element("document", [body]), num_pairs
+    def paragraphs():
+        body = next(child for child in html_element if element_tag(child) == "body")
+        for child in body:
+            for wp in convert_block(child):
+                yield wp.to_etree()
+
+    return paragraphs(), num_pairs
+
+def parse_html(html):
+    """ Parse the HTML generated by Markdown into an <html> element.
+
+    With lxml, this uses libxml2's HTML parser, which is far faster than
+    html5lib. Its elements are not in the XHTML namespace, but element_tag
+    copes with either. Without lxml, or if libxml2 can't make anything of
+    the input, fall back on html5lib. """
+    if lxml_html is not None:
+        try:
+            return lxml_html.document_fromstring(html)
+        except ET.ParserError:
+            pass
+    return html5lib.parse(html, treebuilder="etree")
+
+def document_xml_bytes(paragraphs):
+    """ Serialize a <w:document> containing the given <w:p> elements.
+
+    With lxml, each paragraph is written out as soon as it is generated, so
+    the whole document never exists as a tree in memory. (lxml redeclares
+    the w: namespace on each paragraph. Harmless.) Plain ElementTree has no
+    incremental writer, so in that case we build the tree first. """
+    buf = io.BytesIO()
+    if hasattr(ET, "xmlfile"):
+        with ET.xmlfile(buf, encoding="UTF-8") as xf:
+            xf.write_declaration()
+            with xf.element(w(u"document"), nsmap={"w": w_ns}):
+                with xf.element(w(u"body")):
+                    for p in paragraphs:
+                        xf.write(p)
+    else:
+        body = ET.Element(w(u"body"))
+        body.extend(paragraphs)
+        document = ET.Element(w(u"document"))
+        document.append(body)
+        ET.ElementTree(document).write(buf, encoding="UTF-8", xml_declaration=True)
+    return buf.getvalue()
+
+def xml_document_bytes(root):
+    """ Serialize an element as a UTF-8 XML document, with an XML declaration.
+    (ElementTree.tostring and lxml's tostring disagree about when to write the
+    declaration, but their write methods both take xml_declaration.) """
+    buf = io.BytesIO()
+    ET.ElementTree(root).write(buf, encoding="UTF-8", xml_declaration=True)
+    return buf.getvalue()
 
 def main(source_file, output_file):
     # First, extract two numbers that we need from the source docx file.
@@ -290,8 +427,14 @@ def main(source_file, output_file):
     numbering_etree = ET.fromstring(numbering_xml_bytes)
     zf.close()
 
-    def w(name):
-        return u"{" + w_ns + u"}" + name
+    # Use the same namespace prefixes as numbering.xml when writing it back.
+    # They are all declared on the root element, so stop parsing there.
+    for event, item in ET.iterparse(io.BytesIO(numbering_xml_bytes),
+                                    events=("start-ns", "start")):
+        if event == "start":
+            break
+        prefix, uri = item
+        ET.register_namespace(prefix, uri)
 
     first_numId = max(int(num.get(w(u"numId")))
                       for num in numbering_etree.findall(w(u"num"))) + 1
@@ -299,70 +442,80 @@ def main(source_file, output_file):
                               for num in numbering_etree.findall(w(u"abstractNum"))) + 1
 
     # Load the file, stripping out everything not prefixed with "//>".
-    # Treat as bytes; it works because UTF-8 is nice.
-    lines = []
-    with codecs.open(source_file, encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            # TODO: run the pipeline separately for each sequence of //> lines
-            # so as not to require extra "blank" //> lines to separate paragraphs.
-            if line.startswith(u"//>"):
-                line = line[3:]
-                if line.startswith(u' '):
-                    line = line[1:]
-                lines.append(line + u"\n")
-
-    source = u"".join(lines)
+    # TODO: run the pipeline separately for each sequence of //> lines
+    # so as not to require extra "blank" //> lines to separate paragraphs.
+    with io.open(source_file, encoding="utf-8", buffering=io_buffer_size) as f:
+        data = f.read()
+    source = u"".join(line + u"\n" for line in doc_line_re.findall(data))
     source = preprocess(source)
 
     # Render from markdown to html to OOXML.
     html = markdown.markdown(source)
     #print(html)
-    html_element = html5lib.parse(html, treebuilder="etree")
-    word_element, num_pairs = html_to_ooxml(html_element, first_numId, first_abstractNumId)
-
-    # Word refuses to open the file if we re-serialize the XML, even though the
-    # infoset hasn't changed. Classy. I don't have the patience to figure out
-    # which xmlns:wtf attribute I need to add. So hack the raw XML bytes
-    # instead. (Works.)
-    def insert_after(s, pattern, extra):
-        i = s.rindex(pattern)
-        if i == -1:
-            raise ValueError("insert_after: pattern not found")
-        i += len(pattern)
-        return s[:i] + extra + s[i:]
-
-    numbering_xml_bytes = insert_after(
-        numbering_xml_bytes, "</w:num>",
-        "".join('<w:num w:numId="{}"><w:abstractNumId w:val="{}"/></w:num>'.format(k, v)
-                for k, v in num_pairs))
-    numbering_xml_bytes = insert_after(
-        numbering_xml_bytes, "</w:abstractNum>",
-        "".join('<w:abstractNum w:abstractNumId="{}">'
-                  '<w:multiLevelType w:val="multilevel"/>'
-                  '<w:numStyleLink w:val="ag3"/>'
-                '</w:abstractNum>'.format(v)
-                for k, v in num_pairs if v > 1000))
-
-    # Generate output.
-    temp_dir = tempfile.mkdtemp()
-    output_docx = "modules.docx"
-    temp_output_docx = os.path.join(temp_dir, output_docx)
-    try:
-        shutil.copy(blank_docx_file, temp_output_docx)
-        os.mkdir(os.path.join(temp_dir, "word"))
-        with open(os.path.join(temp_dir, "word", "document.xml"), "wb") as f:
-            f.write(ET.tostring(word_element, encoding="UTF-8"))
-        with open(os.path.join(temp_dir, "word", "numbering.xml"), "wb") as f:
-            f.write(numbering_xml_bytes)
-        subprocess.check_call(
-            ["zip", "-u", output_docx, "word/document.xml", "word/numbering.xml"],
-            cwd=temp_dir)
-        if os.path.exists(output_docx):
-            os.remove(output_docx)
-        shutil.move(temp_output_docx, output_file)
-    finally:
-        shutil.rmtree(temp_dir)
+    html_element = parse_html(html)
+    paragraphs, num_pairs = html_to_ooxml(html_element, first_numId, first_abstractNumId)
+
+    # This has to happen before the numbering.xml changes below, because it
+    # fills in num_pairs.
+    document_xml = document_xml_bytes(paragraphs)
+
+    # Add a <w:num> for each list we generated, and an <w:abstractNum> for
+    # each new numbering scheme. The schema requires all the abstractNums to
+    # come before all the nums, so insert each batch right after the last
+    # existing element of its kind.
+    def insert_after_last(parent, tag, new_children):
+        i = max(i for i, child in enumerate(parent) if child.tag == tag) + 1
+        parent[i:i] = new_children
+
+    new_nums = []
+    for k, v in num_pairs:
+        num = ET.Element(w(u"num"), {w(u"numId"): str(k)})
+        ET.SubElement(num, w(u"abstractNumId"), {w(u"val"): str(v)})
+        new_nums.append(num)
+    insert_after_last(numbering_etree, w(u"num"), new_nums)
+
+    new_abstract_nums = []
+    for k, v in num_pairs:
+        if v > 1000:
+            abstract_num = ET.Element(w(u"abstractNum"), {w(u"abstractNumId"): str(v)})
+            ET.SubElement(abstract_num, w(u"multiLevelType"), {w(u"val"): u"multilevel"})
+            ET.SubElement(abstract_num, w(u"numStyleLink"), {w(u"val"): u"ag3"})
+            new_abstract_nums.append(abstract_num)
+    insert_after_last(numbering_etree, w(u"abstractNum"), new_abstract_nums)
+
+    # Word refuses to open the file if ElementTree writes the root start tag,
+    # because ElementTree drops namespace declarations that aren't used by
+    # any element or attribute name, such as the ones named in
+    # mc:Ignorable. So keep the original root start tag (every prefix in it
+    # was registered above, so the rest of the document agrees with it) and
+    # take everything after it from the modified tree.
+    original_root_end = start_tag_re.search(numbering_xml_bytes).end()
+    new_xml_bytes = xml_document_bytes(numbering_etree)
+    new_root_end = start_tag_re.search(new_xml_bytes).end()
+    numbering_xml_bytes = (numbering_xml_bytes[:original_root_end]
+                           + new_xml_bytes[new_root_end:])
+
+    # Generate output: a copy of blank.docx with the two parts we generated
+    # swapped in. Everything else is copied over unchanged, in order.
+    replacements = {
+        "word/document.xml": document_xml,
+        "word/numbering.xml": numbering_xml_bytes,
+    }
+    now = time.localtime()[:6]
+    with zipfile.ZipFile(blank_docx_file, "r") as blank, \
+         zipfile.ZipFile(output_file, "w") as out:
+        for info in blank.infolist():
+            data = replacements.get(info.filename)
+            if data is None:
+                data = blank.read(info)
+                date_time = info.date_time
+            else:
+                date_time = now
+            new_info = zipfile.ZipInfo(info.filename, date_time)
+            new_info.compress_type = info.compress_type
+            new_info.external_attr = info.external_attr
+            new_info.create_system = info.create_system
+            out.writestr(new_info, data)
 
 
 if __name__ == "__main__":
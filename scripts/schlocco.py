@@ -26,10 +26,50 @@ Differences from Docco:
   using deeply preposterous CSS.
 """
 
-import argparse, cgi, codecs, os, re, shutil
+import argparse, cgi, io, multiprocessing, os, re, shutil
 import markdown
 import pygments, pygments.lexers, pygments.formatters
 
+# Buffer size for reading sources and writing output files.
+io_buffer_size = 1 << 20
+
+comment_matcher = re.compile(r'^\s*//\s?')
+
+# For each section, we have both docs_text (really Markdown) and code_text.
+# We'll attempt to put a *tag* somewhere near the beginning of the
+# docs_text that will not disrupt Markdown's layout algorithm. To do this,
+# we use a regexp to match the initial part of docs_text that we must not
+# disrupt. (Since this regexp matches the empty string, we don't have to worry
+# about failing to match.)
+markdown_start = re.compile(
+    r'''(?x)
+    (
+        [ \t>]* \# .* \n    # put the marker after any headings
+      |
+        [ \t>]*\n           # or blank lines
+    )*
+
+    (?:[ \t]* >)?           # put the marker after a blockquote-mark, if any
+    [ \t]*                  # put the marker after all whitespace on the line
+    (?:(?: [1-9][0-9]*\.
+         | \*[ ]
+       )[ \t]*)?            # put it after the list-item marker on this line, if any
+    ''')
+
+numbered_li_start = re.compile(r'^> *\d+\.')
+
+segment_marker = re.compile(r'\(schlocco-source-code-segment-([0-9]+)\)')
+
+js_lexer = pygments.lexers.get_lexer_by_name("javascript")
+html_formatter = pygments.formatters.HtmlFormatter(nowrap=True)
+
+# How long to wait for the worker processes, in seconds. Effectively forever.
+pool_timeout = 1 << 24
+
+def destination(file, config):
+    """ The path of the HTML file generated for the source file `file`. """
+    return os.path.join(config.output, os.path.splitext(os.path.basename(file))[0] + ".html")
+
 def document(options):
     if not os.path.isdir(options.output):
         os.makedirs(options.output)
@@ -37,16 +77,47 @@ def document(options):
     def copyAsset(file):
         shutil.copy(file, os.path.join(options.output, os.path.basename(file)))
 
+    # Sources with the same basename are written to the same destination.
+    # Only render the last of them; rendering them one after another would
+    # overwrite the others anyway, and rendering them in parallel would race.
+    last_source_for = {}
     for filename in options.sources:
-        with codecs.open(filename, 'rt', encoding='utf-8') as f:
-            code = f.read()
-            sections = parse(code, options)
-            rendered_sections = format(sections, options)
-            write(filename, rendered_sections, options)
+        last_source_for[destination(filename, options)] = filename
+    jobs = [(filename, options) for filename in options.sources
+            if last_source_for[destination(filename, options)] == filename]
+
+    # Source files are independent of each other, so when there are several,
+    # render them in parallel.
+    if len(jobs) > 1:
+        pool = multiprocessing.Pool()
+        try:
+            # Not pool.map: in Python 2 a blocking wait with no timeout
+            # can't be interrupted with Ctrl-C.
+            pool.map_async(document_one, jobs).get(pool_timeout)
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+    else:
+        for job in jobs:
+            document_one(job)
     copyAsset(options.css)
     ## if os.path.exists(options.public):
     ##     copyAsset(options.public)
 
+def document_one(job):
+    """ Parse, format and write a single source file. `job` is a
+    (filename, options) pair, so that this can be passed to Pool.map. """
+    filename, options = job
+    with io.open(filename, 'rt', encoding='utf-8', buffering=io_buffer_size) as f:
+        code = f.read()
+    sections = parse(code, options)
+    rendered_sections = format(sections, options)
+    write(filename, rendered_sections, options)
+
 def parse(code, options):
     """ Given a string of source code, **parse** out each block of prose and the code that
     follows it -- by detecting which is which, line by line -- and then create an
@@ -55,29 +126,29 @@ def parse(code, options):
     """
     lines = code.splitlines()
     sections = []
-    pieces = ['', '']
+    docs_buf = []
+    code_buf = []
 
     def save():
-        result = tuple(pieces)
-        pieces[:] = ['', '']
+        result = (''.join(docs_buf), ''.join(code_buf))
+        del docs_buf[:]
+        del code_buf[:]
         return result
 
     # Our quick-and-dirty implementation of the literate programming style. Simply
     # invert the prose and code relationship on a per-line basis, and then continue as
     # normal below.
 
-    commentMatcher = re.compile(r'^\s*//\s?')
-
     for line in lines:
-        match = re.match(commentMatcher, line)
+        match = comment_matcher.match(line)
         if match:
-            if pieces[1]:
+            if code_buf:
                 yield save()
-            pieces[0] += line[match.end():] + "\n"
+            docs_buf.append(line[match.end():] + "\n")
             if "---" in line or "===" in line:
                 yield save()
         else:
-            pieces[1] += line + "\n"
+            code_buf.append(line + "\n")
     yield save()
 
 def format(sections, config):
@@ -88,33 +159,8 @@ def format(sections, config):
     docs_segments = []
     code_segments = []
 
-    # For each section, we have both docs_text (really Markdown) and code_text.
-    # We'll attempt to put a *tag* somewhere near the beginning of the
-    # docs_text that will not disrupt Markdown's layout algorithm. To do this,
-    # we use a regexp to match the initial part of docs_text that we must not
-    # disrupt. (Since this regexp matches the empty string, we don't have to worry
-    # about failing to match.)
-
-
-    markdown_start = re.compile(
-        r'''(?x)
-        (
-            [ \t>]* \# .* \n    # put the marker after any headings
-          |
-            [ \t>]*\n           # or blank lines
-        )*
-
-        (?:[ \t]* >)?           # put the marker after a blockquote-mark, if any
-        [ \t]*                  # put the marker after all whitespace on the line
-        (?:(?: [1-9][0-9]*\.
-             | \*[ ]
-           )[ \t]*)?            # put it after the list-item marker on this line, if any
-        ''')
-
-    lexer = pygments.lexers.get_lexer_by_name("javascript")
-    formatter = pygments.formatters.HtmlFormatter(nowrap=True)
     for n, (docs_text, code_text) in enumerate(sections):
-        match = re.match(markdown_start, docs_text)
+        match = markdown_start.match(docs_text)
         left = docs_text[:match.end()]
         right = docs_text[match.end():]
         if right == '':
@@ -123,7 +169,7 @@ def format(sections, config):
 
         # Add a blank line between sections, unless this section starts with a
         # numbered list item.
-        if re.match(r'^> *\d+\.', docs_text) is None:
+        if numbered_li_start.match(docs_text) is None:
             if docs_text.startswith(">"):
                 blank = ">\n"
             else:
@@ -132,7 +178,7 @@ def format(sections, config):
 
         docs_segments.append(docs_text)
 
-        code_html = pygments.highlight(code_text, lexer, formatter)
+        code_html = pygments.highlight(code_text, js_lexer, html_formatter)
 
         # Amazingly, pygments strips trailing blank lines. Rather than
         # painstakingly correcting for this insult, just tack on an extra
@@ -146,9 +192,8 @@ def format(sections, config):
     docs_html = markdown.markdown(all_docs_md)
 
     # Substitute code segments into the generated HTML.
-    return re.sub(r'\(schlocco-source-code-segment-([0-9]+)\)',
-                  lambda match: code_segments[int(match.group(1))],
-                  docs_html)
+    return segment_marker.sub(lambda match: code_segments[int(match.group(1))],
+                              docs_html)
 
 def write(source_filename, sections_html, config):
     """ Once all of the code has finished highlighting, we can **write** the
@@ -159,9 +204,6 @@ def write(source_filename, sections_html, config):
     got one installed in this virtualenv)
     """
 
-    def destination(file):
-        return os.path.join(config.output, os.path.splitext(os.path.basename(file))[0] + ".html")
-
     pyg_css = pygments.formatters.HtmlFormatter().get_style_defs('span.src > code')
 
     # TODO: <title>
@@ -178,9 +220,9 @@ def write(source_filename, sections_html, config):
             + '</body>\n'
             + '</html>\n')
 
-    dest = destination(source_filename)
+    dest = destination(source_filename, config)
     print("schlocco: {} -> {}".format(source_filename, dest))
-    with codecs.open(dest, 'w', encoding='utf-8') as out:
+    with io.open(dest, 'w', encoding='utf-8', buffering=io_buffer_size) as out:
         out.write(html)
  
 def main():